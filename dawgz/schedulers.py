@@ -20,8 +20,8 @@ from random import random
 from tabulate import tabulate
 from typing import Any, Callable, Dict, Sequence
 
-from .utils import cat, comma_separated, future, pickle, runpickle, slugify, trace
-from .workflow import Job, cycles
+from .utils import cat, dumps, future, pickle, runpickle, slugify, trace
+from .workflow import Job, cycles, toposort
 from .workflow import prune as _prune
 
 DIR = os.environ.get("DAWGZ_DIR", ".dawgz")
@@ -61,6 +61,7 @@ class Scheduler(ABC):
 
         # Jobs
         self.order = {}
+        self.tags = {}
         self.results = {}
         self.traces = {}
 
@@ -78,18 +79,23 @@ class Scheduler(ABC):
                 len(self.traces),
             ))
 
+    def __setstate__(self, state: Dict):
+        state.setdefault("tags", {})  # pickled before tags were memoized
+        self.__dict__.update(state)
+
     @staticmethod
     def load(path: Path) -> Scheduler:
         with open(path / "dump.pkl", "rb") as f:
             return pickle.load(f)
 
     def tag(self, job: Job) -> str:
-        if job in self.order:
-            i = self.order[job]
-        else:
-            i = self.order[job] = len(self.order)
+        tag = self.tags.get(job)
+
+        if tag is None:
+            i = self.order.setdefault(job, len(self.order))
+            tag = self.tags[job] = f"{i:04d}_{slugify(job.name)}"
 
-        return f"{i:04d}_{slugify(job.name)}"
+        return tag
 
     def state(self, job: Job, i: int = None) -> str:
         if job in self.traces:
@@ -151,13 +157,26 @@ class Scheduler(ABC):
         if prune:
             jobs = _prune(*jobs)
 
+        # Submit parents before their children, unless the children can never run
+        jobs = toposort(*jobs, expand=lambda job: job.satisfiable)
+
         with self.context():
             asyncio.run(self.wait(*jobs))
 
     async def wait(self, *jobs: Job):
-        if jobs:
-            await asyncio.wait(map(asyncio.create_task, map(self.submit, jobs)))
-            await asyncio.wait(map(asyncio.create_task, map(self.submit, self.order)))
+        # Launch all jobs upfront, parents before children
+        for job in jobs:
+            if job not in self.results:
+                self.results[job] = future(self._submit(job), return_exceptions=True)
+
+        pending = jobs
+
+        while pending:
+            for job in pending:
+                await self.submit(job)
+
+            # Dependencies left running by jobs waiting for "any"
+            pending = [job for job, result in self.results.items() if isawaitable(result)]
 
     async def submit(self, job: Job) -> Any:
         if job in self.results:
@@ -206,7 +225,8 @@ class AsyncScheduler(Scheduler):
         r"""
         Arguments:
             name: The name of the workflow.
-            pools: The number of processing pools. If `None`, use threads instead.
+            pools: The number of processing pools. If `None`, use one thread per CPU
+                instead.
             kwargs: Keyword arguments passed to :class:`Scheduler`.
         """
 
@@ -217,7 +237,7 @@ class AsyncScheduler(Scheduler):
     @contextmanager
     def context(self):
         if self.pools is None:
-            self.executor = cf.ThreadPoolExecutor()
+            self.executor = cf.ThreadPoolExecutor(os.cpu_count())
         else:
             self.executor = cf.ProcessPoolExecutor(self.pools)
 
@@ -232,31 +252,25 @@ class AsyncScheduler(Scheduler):
             for dep, status in job.dependencies.items()
         ]
 
-        while pending:
-            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in asyncio.as_completed(pending):
+            result, status = await task
 
-            for task in done:
-                result, status = task.result()
+            if isinstance(result, JobFailedError) and status != "success":
+                result = None
+            elif not isinstance(result, Exception) and status == "failure":
+                result = JobNotFailedError(f"{job}")
 
-                if isinstance(result, JobFailedError) and status != "success":
-                    result = None
-                elif not isinstance(result, Exception) and status == "failure":
-                    result = JobNotFailedError(f"{job}")
+            if isinstance(result, Exception):
+                if job.waitfor == "all":
+                    raise DependencyNeverSatisfiedError(str(job)) from result
+            elif job.waitfor == "any":
+                return
 
-                if isinstance(result, Exception):
-                    if job.waitfor == "all":
-                        raise DependencyNeverSatisfiedError(str(job)) from result
-                elif job.waitfor == "any":
-                    break
-            else:
-                continue
-            break
-        else:
-            if job.dependencies and job.waitfor == "any":
-                raise DependencyNeverSatisfiedError(str(job))
+        if job.dependencies and job.waitfor == "any":
+            raise DependencyNeverSatisfiedError(str(job))
 
     async def exec(self, job: Job) -> Any:
-        dump = pickle.dumps(job.run)
+        dump = dumps(job.run)
         call = partial(self.remote, runpickle, dump)
 
         try:
@@ -321,6 +335,7 @@ class SlurmScheduler(Scheduler):
         shell: str = os.environ.get("SHELL", "/bin/sh"),
         interpreter: str = "python",
         env: Sequence[str] = [],  # noqa: B006
+        submitters: int = 64,
         **kwargs,
     ):
         r"""
@@ -329,6 +344,7 @@ class SlurmScheduler(Scheduler):
             shell: The scripting shell.
             interpreter: The Python interpreter.
             env: A sequence of commands to execute before each job is launched.
+            submitters: The maximum number of concurrent `sbatch` submissions.
             kwargs: Keyword arguments passed to :class:`Scheduler`.
         """
 
@@ -341,6 +357,31 @@ class SlurmScheduler(Scheduler):
         self.interpreter = interpreter
         self.env = env
 
+        # Submission
+        self.submitters = submitters
+        self.offsets = {}
+
+    @contextmanager
+    def context(self):
+        self.executor = cf.ThreadPoolExecutor(self.submitters)
+
+        try:
+            yield None
+        finally:
+            self.executor.shutdown()
+            del self.executor
+
+    def sbatch(self, shfile: Path, script: str) -> str:
+        with open(shfile, "w") as f:
+            f.write(script)
+
+        return subprocess.run(
+            ["sbatch", "--parsable", str(shfile)],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+
     @lru_cache(None)  # noqa: B019
     def sacct(self, jobid: str) -> Dict[str, str]:
         text = subprocess.run(
@@ -416,6 +457,44 @@ class SlurmScheduler(Scheduler):
             text=True,
         ).stderr.strip("\n")
 
+    async def wait(self, *jobs: Job):
+        # Pickle jobs (sorted with their dependencies by __call__)
+        pklfile = self.path / "table.pkl"
+
+        with open(pklfile, "ab") as f:  # keep the jobs of previous calls valid
+            for job in jobs:
+                if job not in self.offsets:
+                    self.offsets[job] = f.tell()  # each task only unpickles its own job
+                    f.write(dumps(job.run))
+
+        pyfile = self.path / "run.py"
+
+        with open(pyfile, "w") as f:
+            f.write(
+                "\n".join([
+                    "import argparse",
+                    "import pickle",
+                    "",
+                    "parser = argparse.ArgumentParser()",
+                    "parser.add_argument('offset', type=int)",
+                    "parser.add_argument('-i', '--index', type=int, default=None)",
+                    "",
+                    "args = parser.parse_args()",
+                    "",
+                    "with open('{}', 'rb') as f:".format(pklfile),
+                    "    f.seek(args.offset)",
+                    "    run = pickle.load(f)",
+                    "",
+                    "if args.index is None:",
+                    "    run()",
+                    "else:",
+                    "    run(args.index)",
+                    "",
+                ])
+            )
+
+        await super().wait(*jobs)
+
     async def satisfy(self, job: Job) -> str:
         results = await asyncio.gather(*map(self.submit, job.dependencies))
 
@@ -425,28 +504,18 @@ class SlurmScheduler(Scheduler):
 
     async def exec(self, job: Job) -> Any:
         # Submission script
-        lines = [
-            f"#!{self.shell}",
-            "#",
-            f'#SBATCH --job-name="{job.name}"',
-        ]
-
-        if job.array is not None:
-            indices = comma_separated(job.array)
-
-            if job.array_throttle is None:
-                lines.append(f"#SBATCH --array={indices}")
-            else:
-                lines.append(f"#SBATCH --array={indices}%{job.array_throttle}")
-
         tag = self.tag(job)
 
         if job.array is None:
+            array = ""
             logfile = self.path / f"{tag}.log"
         else:
-            logfile = self.path / f"{tag}_%a.log"
+            if job.array_throttle is None:
+                array = f"#SBATCH --array={job.indices}\n"
+            else:
+                array = f"#SBATCH --array={job.indices}%{job.array_throttle}\n"
 
-        lines.append(f"#SBATCH --output={logfile}")
+            logfile = self.path / f"{tag}_%a.log"
 
         ## Settings
         settings = self.settings.copy()
@@ -458,19 +527,13 @@ class SlurmScheduler(Scheduler):
             assert not key.startswith("ntasks"), "multi-task jobs not supported"
 
         nodes = settings.pop("nodes", 1)
-
-        lines.append("#")
-        lines.append("#SBATCH --nodes=" + f"{nodes}")
-        lines.append("#SBATCH --ntasks-per-node=1")
-
-        for key, value in settings.items():
-            key = self.translate.get(key, key)
-
-            if type(value) is bool:
-                if value:
-                    lines.append(f"#SBATCH --{key}")
-            else:
-                lines.append(f"#SBATCH --{key}={value}")
+        options = "".join(
+            f"#SBATCH --{self.translate.get(key, key)}\n"
+            if value is True
+            else f"#SBATCH --{self.translate.get(key, key)}={value}\n"
+            for key, value in settings.items()
+            if value is not False
+        )
 
         ## Dependencies
         sep = "?" if job.waitfor == "any" else ","
@@ -485,69 +548,49 @@ class SlurmScheduler(Scheduler):
         ]
 
         if deps:
-            lines.append("#")
-            lines.append("#SBATCH --dependency=" + sep.join(deps))
-
-        lines.append("")
+            dependency = f"#\n#SBATCH --dependency={sep.join(deps)}\n"
+        else:
+            dependency = ""
 
         ## Environment
         if self.env:
-            lines.extend([*self.env, ""])
-
-        ## Pickle job
-        pklfile = self.path / f"{tag}.pkl"
-
-        with open(pklfile, "wb") as f:
-            pickle.dump(job.run, f)
+            env = "".join(f"{command}\n" for command in self.env) + "\n"
+        else:
+            env = ""
 
-        pyfile = self.path / f"{tag}.py"
-
-        with open(pyfile, "w") as f:
-            f.write(
-                "\n".join([
-                    "import argparse",
-                    "import pickle",
-                    "",
-                    "parser = argparse.ArgumentParser()",
-                    "parser.add_argument('-i', '--index', type=int, default=None)",
-                    "",
-                    "args = parser.parse_args()",
-                    "",
-                    "with open('{}', 'rb') as f:".format(pklfile),
-                    "    if args.index is None:",
-                    "        pickle.load(f)()",
-                    "    else:",
-                    "        pickle.load(f)(args.index)",
-                    "",
-                ])
-            )
+        ## Job
+        pyfile = self.path / "run.py"
 
         if job.interpreter is None:
             interpreter = self.interpreter
         else:
             interpreter = job.interpreter
 
+        offset = self.offsets[job]
+
         if job.array is None:
-            lines.append(f"srun {interpreter} {pyfile}")
+            command = f"srun {interpreter} {pyfile} {offset}"
         else:
-            lines.append(f"srun {interpreter} {pyfile} -i $SLURM_ARRAY_TASK_ID")
-
-        lines.append("")
-
-        ## Save
+            command = f"srun {interpreter} {pyfile} {offset} -i $SLURM_ARRAY_TASK_ID"
+
+        script = f"""\
+#!{self.shell}
+#
+#SBATCH --job-name="{job.name}"
+{array}#SBATCH --output={logfile}
+#
+#SBATCH --nodes={nodes}
+#SBATCH --ntasks-per-node=1
+{options}{dependency}
+{env}{command}
+"""
+
+        ## Save and submit script
         shfile = self.path / f"{tag}.sh"
 
-        with open(shfile, "w") as f:
-            f.write("\n".join(lines))
-
-        # Submit script
         try:
-            text = subprocess.run(
-                ["sbatch", "--parsable", str(shfile)],
-                capture_output=True,
-                check=True,
-                text=True,
-            ).stdout
+            loop = asyncio.get_running_loop()
+            text = await loop.run_in_executor(self.executor, self.sbatch, shfile, script)
 
             jobid, *_ = text.strip("\n").split(";")  # ignore cluster name
 
@@ -3,6 +3,7 @@ r"""Miscellaneous helpers"""
 import asyncio
 import cloudpickle as pickle
 import inspect
+import pickle as stdpickle
 import sys
 import traceback
 
@@ -65,6 +66,29 @@ def comma_separated(integers: Iterable[int]) -> str:
     return ",".join(map(fmt, *zip(*intervals)))
 
 
+def dumps(obj: Any) -> bytes:
+    r"""Pickles an object, with the standard pickler if it is a function that can be
+    pickled by reference, and with cloudpickle otherwise."""
+
+    module = getattr(obj, "__module__", None)
+
+    if (
+        inspect.isfunction(obj)
+        and obj.__qualname__ == obj.__name__
+        and module not in (None, "__main__")
+        and not any(
+            module == name or module.startswith(name + ".")
+            for name in pickle.list_registry_pickle_by_value()
+        )
+    ):
+        try:
+            return stdpickle.dumps(obj, protocol=5)
+        except stdpickle.PicklingError:  # e.g. the module attribute is a job
+            pass
+
+    return pickle.dumps(obj, protocol=5)
+
+
 def eprint(*args, **kwargs):
     r"""Prints to the standard error stream."""
 
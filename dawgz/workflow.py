@@ -3,7 +3,7 @@ r"""Workflow graph components"""
 from __future__ import annotations
 
 from functools import cached_property
-from typing import Any, Callable, Dict, Iterable, Iterator, List, Set, Union
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Set, Union
 
 from .utils import accepts, comma_separated, every, pickle
 
@@ -11,6 +11,8 @@ from .utils import accepts, comma_separated, every, pickle
 class Node(object):
     r"""Abstract graph node"""
 
+    _version: int = 0  # bumped when an edge is added, removing one cannot create a cycle
+
     def __init__(self):
         super().__init__()
 
@@ -21,6 +23,8 @@ class Node(object):
         self.children[node] = edge
         node.parents[self] = edge
 
+        Node._version += 1
+
     def add_parent(self, node: Node, edge: Any = None):
         node.add_child(self, edge)
 
@@ -31,6 +35,18 @@ class Node(object):
     def rm_parent(self, node: Node):
         node.rm_child(self)
 
+    def clear_children(self):
+        for node in self.children:
+            del node.parents[self]
+
+        self.children.clear()
+
+    def clear_parents(self):
+        for node in self.parents:
+            del node.children[self]
+
+        self.parents.clear()
+
 
 class Job(Node):
     r"""Job node"""
@@ -77,31 +93,69 @@ class Job(Node):
         # Conditions
         self._postconditions = []
 
+        # Cache
+        self._run = None
+
     def __getstate__(self) -> Dict:
         state = self.__dict__.copy()
 
-        for key in ["_f", "_postconditions"]:
+        for key in ["_f", "_postconditions", "_run"]:
             state.pop(key, None)
 
         return state
 
+    def __setstate__(self, state: Dict):
+        if "array" in state:  # pickled before Job.array became a property
+            array = state.pop("array")
+            state["_array"] = None if array is None else frozenset(array)
+            state["_indices"] = None
+
+        self.__dict__.update(state)
+
+    @property
+    def array(self) -> FrozenSet[int]:
+        return self._array
+
+    @array.setter
+    def array(self, array: Iterable[int]):
+        self._array = None if array is None else frozenset(array)  # keeps indices valid
+        self._indices = None
+
+    @property
+    def indices(self) -> str:
+        if self._indices is None:
+            self._indices = comma_separated(self.array)
+
+        return self._indices
+
     @property
     def f(self) -> Callable:
         return pickle.loads(self._f)
 
     @property
     def run(self) -> Callable:
+        if self._run is not None:
+            return self._run
+
         name = self.name
         f = self.f
-        cond = every(self.postconditions)
+        conditions = tuple(self.postconditions)
+
+        if conditions:
+
+            def fun(*args) -> Any:
+                result = f(*args)
 
-        def fun(*args) -> Any:
-            result = f(*args)
+                for condition in conditions:
+                    if not condition(*args):
+                        raise PostconditionNotSatisfiedError(f"{name}{list(args) if args else ''}")
 
-            if not cond(*args):
-                raise PostconditionNotSatisfiedError(f"{name}{list(args) if args else ''}")
+                return result
+
+        else:
+            fun = f
 
-            return result
+        self._run = fun
 
         return fun
 
@@ -112,7 +166,7 @@ class Job(Node):
         if self.array is None:
             return self.name
         else:
-            return self.name + "[" + comma_separated(self.array) + "]"
+            return self.name + "[" + self.indices + "]"
 
     @property
     def dependencies(self) -> Dict[Job, str]:
@@ -145,6 +199,8 @@ class Job(Node):
             assert accepts(condition, 0), "postcondition should expect an argument"
 
         self._postconditions.append(pickle.dumps(condition))
+        self._run = None
+        self.__dict__.pop("done", None)
 
     @property
     def postconditions(self) -> List[Callable]:
@@ -152,7 +208,7 @@ class Job(Node):
 
     @cached_property
     def done(self) -> bool:
-        if not self.postconditions:
+        if not self._postconditions:
             return False
 
         condition = every(self.postconditions)
@@ -197,16 +253,48 @@ def roots(*nodes: Node) -> Set[Node]:
     return {node for node in dfs(*nodes, backward=True) if not node.parents}
 
 
+def toposort(*nodes: Node, expand: Callable[[Node], bool] = None) -> List[Node]:
+    queue = [(node, False) for node in reversed(nodes)]
+    visited = set()
+    order = []
+
+    while queue:
+        node, expanded = queue.pop()
+
+        if expanded:
+            order.append(node)
+        elif node not in visited:
+            queue.append((node, True))
+
+            if expand is None or expand(node):
+                queue.extend((parent, False) for parent in reversed(node.parents))
+
+            visited.add(node)
+
+    return order
+
+
+_acyclic = {}  # sets of nodes found acyclic, for the current graph version only
+
+
 def cycles(*nodes: Node, backward: bool = False) -> Iterator[List[Node]]:
-    queue = [list(nodes)]
+    key = (frozenset(map(id, nodes)), backward)
+    version = Node._version
+
+    if key in _acyclic.get(version, ()):
+        return
+
+    acyclic = True
+
+    queue = [reversed(nodes)]
     path = []
     pathset = set()
     visited = set()
 
     while queue:
-        branch = queue[-1]
+        node = next(queue[-1], None)
 
-        if not branch:
+        if node is None:
             if not path:
                 break
 
@@ -214,24 +302,31 @@ def cycles(*nodes: Node, backward: bool = False) -> Iterator[List[Node]]:
             pathset.remove(path.pop())
             continue
 
-        node = branch.pop()
-
         if node in visited:
             if node in pathset:
+                acyclic = False
                 yield path + [node]
             continue
 
-        queue.append(list(node.parents if backward else node.children))
+        queue.append(reversed(node.parents if backward else node.children))
         path.append(node)
         pathset.add(node)
         visited.add(node)
 
+    if acyclic:
+        if version not in _acyclic:  # drop entries of stale versions
+            _acyclic.clear()
+
+        _acyclic.setdefault(version, set()).add(key)
+
 
 def prune(*jobs: Job) -> Set[Job]:
     for job in dfs(*jobs, backward=True):
         if job.done:
-            job.detach(*job.dependencies)
-        elif job.array is not None and job.postconditions:
+            job.clear_parents()
+            continue
+
+        if job.array is not None and job._postconditions:
             condition = every(job.postconditions)
             job.array = {i for i in job.array if not condition(i)}
 
@@ -246,12 +341,11 @@ def prune(*jobs: Job) -> Set[Job]:
             else:
                 pending.append(dep)
 
-        job.detach(*satisfied, *unsatisfied)
-
         if job.waitfor == "any" and satisfied:
-            job.detach(*pending)
+            job.clear_parents()
             job.unsatisfied.clear()
         else:
+            job.detach(*satisfied, *unsatisfied)
             job.unsatisfied.update(unsatisfied)
 
     return {job for job in jobs if not job.done}